@@ -1,4 +1,5 @@
 import logging
+import random
 import time
 
 from .keithley6517b_mqtt_client import Keithley6517BMQTTClient
@@ -12,14 +13,20 @@ logger = logging.getLogger(__name__)
 if __name__ == "__main__":
     client = Keithley6517BMQTTClient("config.yaml")
 
+    # exponential backoff with jitter, reset after every established session
+    backoff = 0.5
     try:
         while True:
             client.main()
             logger.info(
                 f"Main loop stopped. Disconnected status: {client.disconnected}"
             )
-            logger.info("Attempt to reconnect in 5 seconds ...")
-            time.sleep(5)
+            if client.session_established:
+                backoff = 0.5
+            delay = min(60, backoff) * (0.5 + random.random())
+            logger.info(f"Attempt to reconnect in {delay:.1f} seconds ...")
+            time.sleep(delay)
+            backoff = min(60, backoff * 2)
     except KeyboardInterrupt:
         if client is not None:
             client.stop()
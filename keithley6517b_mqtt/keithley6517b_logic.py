@@ -1,11 +1,10 @@
 import logging
-import queue
+import re
 import threading
 import time
-from concurrent.futures import Future
+from collections import deque
 from ctypes import Array
 from functools import wraps
-from queue import Queue
 from threading import Event
 
 from pymeasure.instruments import Instrument
@@ -16,13 +15,27 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
 
+# numeric part of a reading element such as "+1.234567E-12NADC"
+_READING_RE = re.compile(r"[+\-]?(?:\d+\.?\d*|\.\d+)(?:E[+\-]?\d+)?")
+
+
+def extract_reading(reading):
+    """Returns the value of a reading element, or None if it holds no number."""
+    match = _READING_RE.match(reading)
+    return float(match.group()) if match else None
+
+
 class MyKeithley6517B(Keithley6517B):
 
+    # only the first element of the reply is parsed, as a string, so no float
+    # cast is attempted (and fails) on unit-suffixed or trailing elements
     current = Instrument.measurement(
         ":READ?",
         """ Reads the current in Amps, if configured for this reading.
         """,
-        get_process=Keithley6517B.extract_value,
+        preprocess_reply=lambda reply: reply.partition(",")[0],
+        cast=str,
+        get_process=extract_reading,
     )
 
     def __call__(self, *args, **kwds):
@@ -35,220 +48,511 @@ class KeithleyDeviceIOError(Exception):
     pass
 
 
-def check_connection_decorator(method):
-    @wraps(method)
-    def wrapper(self, *args, **kwargs):
-        self.check_connection()
+class KeithleyCommandError(Exception):
+    """Exception raised when a command fails or is not confirmed by the worker."""
+
+    pass
+
+
+# decorator that serves a getter from the cache while its value is younger than the TTL
+def cache_decorator(key):
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self):
+            ttl = self._cache_ttl.get(key, 0)
+            if ttl <= 0:
+                return method(self)
+            value = self.cached_value(key)
+            if value is not None:
+                return value
+            value = method(self)
+            if value is not None:
+                self._cache[key] = (time.monotonic(), value)
+            return value
+
+        return wrapper
+
+    return decorator
+
+
+# decorator that drops the given cache keys (all keys if none given) after the call
+def invalidate_cache_decorator(*keys):
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                if keys:
+                    for key in keys:
+                        self._cache.pop(key, None)
+                else:
+                    self._cache.clear()
+
+        return wrapper
+
+    return decorator
+
+
+class ResultSlot:
+    """Reusable per-thread hand-off of a single worker result to the waiting caller."""
+
+    __slots__ = ("event", "result", "exception")
+
+    def __init__(self):
+        self.event = Event()
+        self.result = None
+        self.exception = None
+
+    def reset(self):
+        self.event.clear()
+        self.result = None
+        self.exception = None
+
+    def set_result(self, result):
+        self.result = result
+        self.event.set()
+
+    def set_exception(self, exception):
+        self.exception = exception
+        self.event.set()
+
+    def wait(self, name, timeout=10, strict=False):
+        if not self.event.wait(timeout=timeout):
+            if strict:
+                raise KeithleyCommandError(
+                    f"Timeout error in waiting for result of method {name}."
+                )
+            logger.error(
+                "Timeout error in waiting for result of method %s. Returning None.", name
+            )
+            return None
+        if self.exception is None:
+            return self.result
+        if isinstance(self.exception, KeithleyDeviceIOError):
+            raise self.exception
+        if strict:
+            raise KeithleyCommandError(
+                f"Error in method {name}: {self.exception}"
+            ) from self.exception
+        logger.error("Error in method %s: %s. Returning None.", name, self.exception)
+        return None
+
+
+_thread_local = threading.local()
+
+
+# decorator that runs the method on the worker thread and returns its result;
+# the worker connects to the device first if needed and maps VISA errors.
+# With strict=True any other failure, a timeout included, raises
+# KeithleyCommandError instead of returning None, so a write that did not
+# happen is never taken for a success.
+def device_command_decorator(method=None, *, strict=False):
+    if method is None:
+        return lambda method: device_command_decorator(method, strict=strict)
+
+    name = method.__name__
+
+    def checked(self, *args, **kwargs):
+        if not self._is_connected:
+            self.reconnect_thread.request()
+            raise KeithleyDeviceIOError("Keithley peripheral is not connected.")
         try:
             return method(self, *args, **kwargs)
         except VisaIOError as e:
-            self._is_connected.clear()
+            self._is_connected = False
+            self._accessors = {}
+            self.reconnect_thread.request()
             raise KeithleyDeviceIOError(f"Keithley peripheral IO error: {e}")
 
-    return wrapper
-
+    checked.__name__ = name
 
-# decorator that pushes the method to the queue and returns the future result
-def push_method_to_queue_decorator(method):
     @wraps(method)
     def wrapper(self, *args, **kwargs):
-        future = Future()
-        try:
-            self.queue.put((method, self, args, kwargs, future), timeout=1)
-        except (TimeoutError, queue.Full) as e:
-            logger.error(
-                f"Timeout error in putting method {method.__name__} to queue: {e}. Returning None."
-            )
-            return None
-        try:
-            return future.result(timeout=10)
-        except TimeoutError as e:
-            logger.error(
-                f"Timeout error in waiting for result of method {method.__name__}: {e}. Returning None."
-            )
-            return None
+        self.wait_for_command_slot()
+        slot = getattr(_thread_local, "slot", None)
+        if slot is None:
+            slot = _thread_local.slot = ResultSlot()
+        slot.reset()
+        self._put((checked, self, args, kwargs, slot))
+        if not slot.event.wait(timeout=10):
+            # the worker may still fill the slot later, so it must not be reused
+            _thread_local.slot = None
+        return slot.wait(name, timeout=0, strict=strict)
 
     return wrapper
 
 
+def device_property(attr, settable=True):
+    """Builds a cached property proxying ``self.device.<attr>`` through the worker queue."""
+
+    def fget(self):
+        return self._accessors[attr]()
+
+    fget.__name__ = attr
+    fget = cache_decorator(attr)(device_command_decorator(fget))
+    if not settable:
+        return property(fget)
+
+    def fset(self, value):
+        setattr(self.device, attr, value)
+
+    fset.__name__ = attr
+    fset = device_command_decorator(fset, strict=True)
+    fset = invalidate_cache_decorator(attr)(fset)
+    return property(fget, fset)
+
+
+class CommandQueue:
+    """Bounded FIFO of queued device calls.
+
+    When full, the oldest waiting call is dropped and its caller gets a
+    KeithleyDeviceIOError, so bursts cannot grow memory without limit.
+    """
+
+    def __init__(self, maxlen=256):
+        self.maxlen = maxlen
+        self._items = deque()
+        self._not_empty = threading.Condition(threading.Lock())
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, item):
+        dropped = None
+        with self._not_empty:
+            # never drop the stop sentinel
+            if (
+                item is not None
+                and len(self._items) >= self.maxlen
+                and self._items[0] is not None
+            ):
+                dropped = self._items.popleft()
+            self._items.append(item)
+            self._not_empty.notify()
+        if dropped is not None:
+            logger.warning("Command queue full, dropping %s.", dropped[0].__name__)
+            dropped[4].set_exception(
+                KeithleyDeviceIOError("Command dropped: command queue is full.")
+            )
+
+    def get(self):
+        with self._not_empty:
+            while not self._items:
+                self._not_empty.wait()
+            return self._items.popleft()
+
+
 class WorkerThread(threading.Thread):
     def __init__(self, queue):
         super().__init__()
         self.queue = queue
-        self._stop_event = threading.Event()
 
     def run(self):
-        while not self._stop_event.is_set():
-            try:
-                method, that, args, kwargs, future = self.queue.get(timeout=1)
-                future.set_result(method(that, *args, **kwargs))
-            except (TimeoutError, queue.Empty):
-                pass
-            except Exception as e:
-                logger.error(f"Error in worker thread: {e}")
+        # None is the stop sentinel posted by stop()
+        while (item := self.queue.get()) is not None:
+            self.execute(item)
+
+    def execute(self, item):
+        method, that, args, kwargs, slot = item
+        try:
+            slot.set_result(method(that, *args, **kwargs))
+        except Exception as e:
+            # hand the error to the waiting caller instead of letting it time out
+            slot.set_exception(e)
+
+    def stop(self):
+        self.queue.put(None)
+
+
+class ReconnectThread(threading.Thread):
+    """Reconnects the device in the background with exponential backoff.
+
+    Commands fail fast while the device is disconnected and call request()
+    to wake this thread instead of opening the VISA session themselves.
+    """
+
+    def __init__(self, logic, max_backoff=30):
+        super().__init__(daemon=True)
+        self.logic = logic
+        self.max_backoff = max_backoff
+        self._reconnect_event = Event()
+        self._stop_event = Event()
+
+    def run(self):
+        while True:
+            self._reconnect_event.wait()
+            if self._stop_event.is_set():
+                return
+            self._reconnect_event.clear()
+            attempt = 0
+            while not self.logic.is_connected():
+                try:
+                    self.logic.try_connect()
+                except Exception as e:
+                    delay = min(self.max_backoff, 0.5 * 2**attempt)
+                    attempt += 1
+                    logger.warning("%s. Next attempt in %s s.", e, delay)
+                    if self._stop_event.wait(delay):
+                        return
+
+    def request(self):
+        self._reconnect_event.set()
 
     def stop(self):
         self._stop_event.set()
+        self._reconnect_event.set()
 
 
 class Keithley6517BLogic:
+    __slots__ = (
+        "config",
+        "on_connected",
+        "_is_connected",
+        "device",
+        "_accessors",
+        "_sample_ring",
+        "_cache",
+        "_cache_ttl",
+        "_min_command_interval",
+        "_next_slot",
+        "_slot_lock",
+        "queue",
+        "_put",
+        "_uses_worker",
+        "reconnect_thread",
+    )
+
+    # device properties whose getters are bound once per connection in try_connect
+    accessor_names = (
+        "current",
+        "current_nplc",
+        "current_range",
+        "voltage_range",
+        "source_enabled",
+        "source_voltage",
+        "source_voltage_range",
+    )
+
+    _shared_queue = None
+    _shared_worker = None
+    # number of instances that have not called stop_worker_thread() yet
+    _shared_users = 0
+    _shared_worker_lock = threading.Lock()
+
     def __init__(self, config, on_connected):
         self.config = config
         self.on_connected = on_connected
 
-        self._is_connected = Event()
+        self._is_connected = False
 
         self.device = None
+        self._accessors = {}
+
+        # (time, current) samples of the continuous measurement, kept only in
+        # batched telemetry mode
+        self._sample_ring = (
+            deque(maxlen=self.config.get("metric_buffer_limit", 1000))
+            if self.config.get("metric_batch_size", 0) > 0
+            else None
+        )
+
+        # key -> (time.monotonic() of the read, value)
+        self._cache = {}
+        self._cache_ttl = {
+            key: ttl_ms / 1000.0
+            for key, ttl_ms in (self.config.get("cache_ttl_ms") or {}).items()
+        }
+
+        # commands are spaced at least keithley_min_command_interval seconds apart;
+        # a caller only blocks when it arrives before the next free slot
+        self._min_command_interval = self.config.get("keithley_min_command_interval", 0)
+        self._next_slot = 0.0
+        self._slot_lock = threading.Lock()
+
+        # all instances share one queue and one worker thread, which runs until
+        # the last instance calls stop_worker_thread(); a worker started after
+        # that gets a fresh queue, so it never sees the old worker's stop sentinel
+        with Keithley6517BLogic._shared_worker_lock:
+            if Keithley6517BLogic._shared_worker is None:
+                queue = CommandQueue(self.config.get("queue_max", 256))
+                Keithley6517BLogic._shared_queue = queue
+                Keithley6517BLogic._shared_worker = WorkerThread(queue)
+                Keithley6517BLogic._shared_worker.start()
+            Keithley6517BLogic._shared_users += 1
+            self._uses_worker = True
+            self.queue = Keithley6517BLogic._shared_queue
+        self._put = self.queue.put
+
+        self.reconnect_thread = ReconnectThread(self)
+        self.reconnect_thread.start()
+        self.reconnect_thread.request()
+
+    @property
+    def pending_samples(self):
+        """Number of recorded current samples not yet drained."""
+        return 0 if self._sample_ring is None else len(self._sample_ring)
+
+    def record_sample(self, value):
+        """Appends a (time, current) sample of the continuous measurement."""
+        if self._sample_ring is not None:
+            self._sample_ring.append((time.time(), value))
+
+    def drain_samples(self, max_n):
+        """Removes and returns up to max_n oldest (time, current) samples."""
+        samples = []
+        if self._sample_ring is not None:
+            popleft = self._sample_ring.popleft
+            try:
+                while len(samples) < max_n:
+                    samples.append(popleft())
+            except IndexError:
+                pass
+        return samples
 
-        self.queue = Queue(maxsize=1)
-        self.worker_thread = WorkerThread(self.queue)
+    @property
+    def queue_depth(self):
+        """Number of device calls waiting for the worker thread."""
+        return len(self.queue)
 
-    def start_worker_thread(self):
-        self.worker_thread.start()
+    def stop(self):
+        self.reconnect_thread.stop()
 
     def stop_worker_thread(self):
-        self.worker_thread.stop()
-        self.worker_thread.join()
-
-    def check_connection(self):
-        if not self.is_connected():
-            self.try_connect()
+        """Releases the shared worker thread; the last instance to do so stops it."""
+        cls = Keithley6517BLogic
+        with cls._shared_worker_lock:
+            if not self._uses_worker:
+                return
+            self._uses_worker = False
+            cls._shared_users -= 1
+            if cls._shared_users > 0:
+                return
+            worker, cls._shared_worker = cls._shared_worker, None
+        if worker is not None:
+            worker.stop()
+            worker.join()
+
+    def cached_value(self, key):
+        """Returns the cached value of key if still within its TTL, else None."""
+        entry = self._cache.get(key)
+        if entry is not None and time.monotonic() - entry[0] < self._cache_ttl.get(key, 0):
+            return entry[1]
+        return None
+
+    def wait_for_command_slot(self):
+        if self._min_command_interval <= 0:
+            return
+        with self._slot_lock:
+            now = time.monotonic()
+            wait = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self._min_command_interval
+        if wait > 0:
+            time.sleep(wait)
+
+    def close_device(self):
+        """Closes the VISA session of the device, if any, freeing e.g. the serial port."""
+        device, self.device = self.device, None
+        if device is not None:
+            try:
+                device.adapter.close()
+            except Exception as e:
+                logger.debug("Error in closing the previous session: %s", e)
 
     def try_connect(self):
+        # a stale session can keep a serial port busy, so every retry would fail
+        self.close_device()
         try:
-            logger.info(
-                f"Connecting to Keithley 6517B at {self.config['keithley_visa_resource']} ..."
-            )
-            self.device = MyKeithley6517B(
-                self.config["keithley_visa_resource"],
-                asrl={"baud_rate": self.config["keithley_baud_rate"]},
-                timeout=self.config["keithley_timeout"],
-            )
-
-            self._is_connected.set()
+            resource = self.config["keithley_visa_resource"]
+            logger.info("Connecting to Keithley 6517B at %s ...", resource)
+            kwargs = {"timeout": self.config["keithley_timeout"]}
+            # the baud rate only applies to serial sessions
+            if resource.upper().startswith("ASRL"):
+                kwargs["asrl"] = {"baud_rate": self.config["keithley_baud_rate"]}
+            self.device = MyKeithley6517B(resource, **kwargs)
+            # skip the descriptor lookup on every read by binding the getters once
+            device_type = type(self.device)
+            self._accessors = {
+                name: getattr(device_type, name).fget.__get__(self.device)
+                for name in self.accessor_names
+            }
+
+            self._is_connected = True
             logger.info("Keithley 6517B connected.")
             if self.on_connected is not None:
                 self.on_connected()
 
         except VisaIOError as e:
-            self._is_connected.clear()
+            self._is_connected = False
             raise KeithleyDeviceIOError(f"Keithley peripheral connection error: {e}")
 
     def is_connected(self):
-        return self._is_connected.is_set()
+        return self._is_connected
 
-    @push_method_to_queue_decorator
-    @check_connection_decorator
+    current = device_property("current")
+    current_nplc = device_property("current_nplc", settable=False)
+    current_range = device_property("current_range")
+    voltage_range = device_property("voltage_range")
+    source_voltage = device_property("source_voltage")
+    source_voltage_range = device_property("source_voltage_range")
+
+    @invalidate_cache_decorator("source_voltage_range")
+    @device_command_decorator
     def apply_voltage(self, value):
         self.device.apply_voltage(value)
 
-    @property
-    @push_method_to_queue_decorator
-    @check_connection_decorator
-    def current(self) -> float:
-        logger.debug("Reading current from Keithley 6517B ...")
-        return self.device.current
-
-    @current.setter
-    @push_method_to_queue_decorator
-    @check_connection_decorator
-    def current(self, value):
-        self.device.current = value
-
-    @property
-    @push_method_to_queue_decorator
-    @check_connection_decorator
-    def current_nplc(self) -> float:
-        return self.device.current_nplc
-
-    @push_method_to_queue_decorator
-    @check_connection_decorator
+    @invalidate_cache_decorator("voltage_range", "source_voltage_range")
+    @device_command_decorator
     def auto_range_source(self):
         self.device.auto_range_source()
 
-    @property
-    @push_method_to_queue_decorator
-    @check_connection_decorator
-    def voltage_range(self) -> float:
-        return self.device.voltage_range
-
-    @voltage_range.setter
-    @push_method_to_queue_decorator
-    @check_connection_decorator
-    def voltage_range(self, value):
-        self.device.voltage_range = value
-
-    @property
-    @push_method_to_queue_decorator
-    @check_connection_decorator
-    def current_range(self) -> float:
-        return self.device.current_range
-
-    @current_range.setter
-    @push_method_to_queue_decorator
-    @check_connection_decorator
-    def current_range(self, value):
-        self.device.current_range = value
-
-    @property
-    @push_method_to_queue_decorator
-    @check_connection_decorator
-    def source_enabled(self) -> bool:
-        return self.device.source_enabled
+    source_enabled = device_property("source_enabled", settable=False)
 
+    # not queued itself: enable_source/disable_source are, and queueing them
+    # from the worker thread would wait on the worker's own queue
     @source_enabled.setter
-    @push_method_to_queue_decorator
-    @check_connection_decorator
     def source_enabled(self, value):
+        if self.cached_value("source_enabled") == bool(value):
+            return
         self.enable_source() if value else self.disable_source()
 
-    @push_method_to_queue_decorator
-    @check_connection_decorator
+    @invalidate_cache_decorator("source_enabled")
+    @device_command_decorator(strict=True)
     def disable_source(self):
         logger.debug("Disabling source ...")
         self.device.disable_source()
 
-    @push_method_to_queue_decorator
-    @check_connection_decorator
+    @invalidate_cache_decorator("source_enabled")
+    @device_command_decorator(strict=True)
     def enable_source(self):
         logger.debug("Enabling source ...")
         self.device.enable_source()
 
-    @push_method_to_queue_decorator
-    @check_connection_decorator
+    @device_command_decorator
+    def read_current_batch(self, n):
+        """Reads n current samples in one queued call.
+
+        Returns a tuple (t0, dt, values) with the wall-clock time of the first
+        read, the mean spacing of the samples in seconds and the list of readings.
+        """
+        t0 = time.time()
+        start = time.monotonic()
+        read_current = self._accessors["current"]
+        values = [read_current() for _ in range(n)]
+        dt = (time.monotonic() - start) / n
+        return t0, dt, values
+
+    @invalidate_cache_decorator("current_range", "current_nplc")
+    @device_command_decorator
     def measure_current(self, nplc, current, auto_range):
         return self.device.measure_current(nplc, current, auto_range)
 
-    @push_method_to_queue_decorator
-    @check_connection_decorator
+    @invalidate_cache_decorator()
+    @device_command_decorator
     def reset(self):
         self.device.reset()
 
-    @push_method_to_queue_decorator
-    @check_connection_decorator
+    @invalidate_cache_decorator("source_enabled", "source_voltage")
+    @device_command_decorator
     def shutdown(self):
         self.device.shutdown()
-
-    @property
-    @push_method_to_queue_decorator
-    @check_connection_decorator
-    def source_voltage(self) -> float:
-        return self.device.source_voltage
-
-    @source_voltage.setter
-    @push_method_to_queue_decorator
-    @check_connection_decorator
-    def source_voltage(self, value):
-        self.device.source_voltage = value
-
-    @property
-    @push_method_to_queue_decorator
-    @check_connection_decorator
-    def source_voltage_range(self) -> float:
-        return self.device.source_voltage_range
-
-    @source_voltage_range.setter
-    @push_method_to_queue_decorator
-    @check_connection_decorator
-    def source_voltage_range(self, value):
-        self.device.source_voltage_range = value
@@ -1,46 +1,97 @@
 import json
 import logging
+import os
+import re
 import socket
-from functools import wraps
+from collections import deque
+from functools import lru_cache, wraps
+from math import isfinite
 from select import select
-from threading import Event, Thread
-from time import time
+from threading import Condition, Event, Thread
+from time import monotonic, time
 
 import paho.mqtt.client as mqtt
 import yaml
 
-from .keithley6517b_logic import Keithley6517BLogic, KeithleyDeviceIOError
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:  # PyYAML built without libyaml
+    from yaml import SafeLoader
+
+try:
+    from orjson import dumps as json_dumps
+    from orjson import loads as json_loads
+except ImportError:  # orjson is optional, fall back to the standard library
+    from json import JSONEncoder
+    from json import loads as json_loads
+
+    # compact like orjson, the default separators only add whitespace on the wire
+    json_dumps = JSONEncoder(separators=(",", ":")).encode
+
+from .keithley6517b_logic import (
+    Keithley6517BLogic,
+    KeithleyCommandError,
+    KeithleyDeviceIOError,
+)
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
 
-def is_number(s):
-    try:
-        float(s)
-        return True
-    except ValueError:
-        return False
+# parsed files are memoized per (path, modification time)
+@lru_cache(maxsize=8)
+def load_yaml(path, mtime_ns):
+    with open(path, "r") as file:
+        return yaml.load(file, Loader=SafeLoader)
+
 
+# sender_payload of the periodic current measurement
+_REGULAR_PAYLOAD = {"regular": True}
 
-def all_in(keys, dictionary):
-    return all(key in dictionary for key in keys)
+# continuous current responses only differ in the value, so the rest of the
+# JSON document is serialized once
+_REGULAR_CURRENT_PREFIX = b'{"value":'
+_REGULAR_CURRENT_SUFFIX = (
+    b',"sender_payload":'
+    + json.dumps(_REGULAR_PAYLOAD, separators=(",", ":")).encode()
+    + b',"measure_continously":true}'
+)
+
+# payload keys that make measure_current reconfigure the device
+_MEASURE_CURRENT_KEYS = frozenset(("nplc", "current", "auto_range"))
+
+_NUM_RE = re.compile(r"[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?").fullmatch
+
+
+def is_number(s):
+    if isinstance(s, str):
+        return _NUM_RE(s) is not None
+    # JSON true/false decode to bool, which is an int subclass
+    return isinstance(s, (int, float)) and not isinstance(s, bool)
 
 
 def handle_connection_error(method):
+    name = method.__name__
+    command = name.removeprefix("handle_")  # e.g. "source_voltage_range"
+
     @wraps(method)
     def wrapper(self, *args, **kwargs):
-        logger.debug(
-            f"Calling method: {method.__name__} with args: {args} and kwargs: {kwargs}"
-        )
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            logger.debug(
+                "Calling method: %s with args: %s and kwargs: %s", name, args, kwargs
+            )
         try:
             result = method(self, *args, **kwargs)
-            logger.debug(f"Method {method.__name__} returned: {result}")
+            if debug:
+                logger.debug("Method %s returned: %s", name, result)
             return result
         except KeithleyDeviceIOError as e:
-            command = method.__name__.split("_")[1]  # Extract command from method name
-            logger.warning(f"Error in method {method.__name__}: {e}")
+            logger.warning("Error in method %s: %s", name, e)
             self.publish_connection_error(command, str(e))
+        except KeithleyCommandError as e:
+            logger.warning("Error in method %s: %s", name, e)
+            self.publish_error(command, str(e))
 
     return wrapper
 
@@ -57,6 +108,37 @@ class Keithley6517BMQTTClientNotConnectedException(Exception):
 
 
 class Keithley6517BMQTTClient:
+    __slots__ = (
+        "config",
+        "topic_base",
+        "device_name",
+        "user_stop_event",
+        "measure_continously",
+        "_commands",
+        "_commands_ready",
+        "_commands_max",
+        "client",
+        "_connected",
+        "session_established",
+        "disconnected",
+        "metric_batch_size",
+        "_flush_interval",
+        "_measure_interval_s",
+        "_verify_writes",
+        "_batch_max",
+        "_pending_reading",
+        "_current_retained",
+        "last_flush",
+        "_handlers",
+        "_response_topics",
+        "_error_topic",
+        "_disconnected_topic",
+        "_connected_topic",
+        "_telemetry_topic",
+        "_cmd_prefix_len",
+        "keithley",
+    )
+
     def __init__(self, config_file):
         self.config = self.load_config(config_file)
         self.topic_base = self.config["topic_base"]
@@ -64,6 +146,68 @@ class Keithley6517BMQTTClient:
 
         self.user_stop_event = Event()
         self.measure_continously = Event()
+        # (command, handler, payload) from on_message, run by the main loop; when
+        # queue_max are waiting the oldest is dropped and reported as an error
+        self._commands = deque()
+        self._commands_ready = Condition()
+        self._commands_max = self.config.get("queue_max", 256)
+
+        self.client = None
+        # broker connection state kept by on_connect/on_disconnect, so publishing
+        # does not have to query paho
+        self._connected = False
+        self.session_established = False
+
+        # batched telemetry: current samples are published in groups on
+        # <topic_base>/telemetry/<device_name>/batch instead of one response each
+        self.metric_batch_size = self.config.get("metric_batch_size", 0)
+        self._flush_interval = self.config.get("flush_interval", 1.0)
+        self.last_flush = time()
+
+        # current_measurement_interval is given in seconds
+        self._measure_interval_s = self.config["current_measurement_interval"]
+
+        self._batch_max = self.config.get("batch_max", 100)
+
+        # MQTTMessageInfo of the last continuous reading, and whether a reading
+        # is retained on the current response topic
+        self._pending_reading = None
+        self._current_retained = False
+
+        # read a written setting back from the device instead of echoing it
+        self._verify_writes = self.config.get("verify_writes", False)
+
+        # last topic level of a command -> handler
+        self._handlers = {
+            "apply_voltage": self.handle_apply_voltage,
+            "auto_range_source": self.handle_auto_range_source,
+            "current": self.handle_current,
+            "current_batch": self.handle_current_batch,
+            "current_range": self.handle_current_range,
+            "disable_source": self.handle_disable_source,
+            "enable_source": self.handle_enable_source,
+            "measure_continously": self.handle_measure_continously,
+            "measure_current": self.handle_measure_current,
+            "reset": self.handle_reset,
+            "shutdown": self.handle_shutdown,
+            "source_enabled": self.handle_source_enabled,
+            "source_voltage": self.handle_source_voltage,
+            "source_voltage_range": self.handle_source_voltage_range,
+        }
+
+        # topics are fixed for the lifetime of the client, so build them once
+        self._response_topics = {
+            command: f"{self.topic_base}/response/{self.device_name}/{command}"
+            for command in (*self._handlers, "voltage_range")
+        }
+        self._error_topic = f"{self.topic_base}/error/{self.device_name}/command"
+        self._disconnected_topic = (
+            f"{self.topic_base}/error/{self.device_name}/disconnected"
+        )
+        self._connected_topic = f"{self.topic_base}/connected/{self.device_name}"
+        self._telemetry_topic = f"{self.topic_base}/telemetry/{self.device_name}/batch"
+        # every subscribed topic starts with this, the command is what follows it
+        self._cmd_prefix_len = len(f"{self.topic_base}/cmnd/{self.device_name}/")
 
         self.keithley = Keithley6517BLogic(
             self.config, on_connected=self.keithley_connected
@@ -71,6 +215,13 @@ class Keithley6517BMQTTClient:
 
     def main(self):
         self.disconnected = (False, None)
+        self._connected = False
+        self.session_established = False
+        self._pending_reading = None
+
+        # commands left over from a lost session are stale
+        with self._commands_ready:
+            self._commands.clear()
 
         self.client = mqtt.Client(
             client_id=self.config["client_id"],
@@ -79,31 +230,58 @@ class Keithley6517BMQTTClient:
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
         self.client.on_disconnect = self.on_disconnect
+        # never hold back or drop outgoing messages on the client side
+        self.client.max_inflight_messages_set(65535)
+        self.client.max_queued_messages_set(0)
 
         self.connect_to_broker()
 
-        self.keithley.start_worker_thread()
-
-        self.last_time = time()
         self.client.loop_start()
 
-        while not self.disconnected[0] and not self.user_stop_event.is_set():
-            # self.do_select()
-            if time() - self.last_time > self.config["current_measurement_interval"]:
-                self.last_time = time()
+        # commands and measurements run here, one at a time, so device I/O never
+        # blocks paho's network thread. Measurements are scheduled on fixed
+        # deadlines, so the time spent measuring does not stretch the interval.
+        interval = self._measure_interval_s
+        deadline = monotonic() + interval
+        commands = self._commands
+        ready = self._commands_ready
+
+        def stopping():
+            return self.disconnected[0] or self.user_stop_event.is_set()
+
+        while not stopping():
+            timeout = deadline - monotonic()
+            if timeout <= 0:
                 self.perform_current_measurement()
+                deadline += interval
+                now = monotonic()
+                if deadline < now:
+                    # fell behind (slow device): skip missed ticks instead of bursting
+                    deadline = now + interval
+                continue
+            with ready:
+                # stop() and on_disconnect notify too
+                ready.wait_for(lambda: commands or stopping(), timeout)
+                if not commands:
+                    continue
+                _, handler, payload = commands.popleft()
+            try:
+                handler(payload)
+            except Exception:
+                logger.exception("Unhandled error in command handler")
 
         self.client.loop_stop()
         self.client = None
 
     def load_config(self, config_file):
-        with open(config_file, "r") as file:
-            config = yaml.safe_load(file)
-        return config
+        return dict(load_yaml(config_file, os.stat(config_file).st_mtime_ns))
 
     def connect_to_broker(self):
         logger.debug(
-            f'Connecting client_id {self.config["client_id"]} to brooker {self.config["mqtt_broker"]}:{self.config["mqtt_port"]}...'
+            "Connecting client_id %s to brooker %s:%s...",
+            self.config["client_id"],
+            self.config["mqtt_broker"],
+            self.config["mqtt_port"],
         )
         try:
             self.client.connect(
@@ -111,65 +289,79 @@ class Keithley6517BMQTTClient:
                 self.config["mqtt_port"],
                 self.config["mqtt_connection_timeout"],
             )
-            self.client.socket().setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 2048)
+            sock = self.client.socket()
+            # room for a burst of publishes or commands, and no Nagle delay on
+            # small packets
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 262144)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 65536)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         except Exception as e:
-            logger.warning(f"Could not connect to broker. Error: {e}")
+            logger.warning("Could not connect to broker. Error: %s", e)
             self.disconnected = True, -1
 
     def on_connect(self, client, userdata, flags, reason_code):
-        logger.debug(f"on_connect with reason code {reason_code}")
+        logger.debug("on_connect with reason code %s", reason_code)
+        self._connected = reason_code == 0
         if reason_code != 0:
             self.disconnected = True, reason_code
             raise Keithley6517BMQTTClientNotConnectedException(
                 f"reason_code = {reason_code}"
             )
 
+        self.session_established = True
+
         # Subscribe to command topics
         self.client.subscribe(f"{self.topic_base}/cmnd/{self.device_name}/#")
 
-    def on_disconnect(self, client, userdata, flags, reason_code):
-        logger.debug(f"on_disconnect with reason code {reason_code}")
+        # a previous session may have left a stale retained reading behind
+        self.clear_retained_current()
+
+        # the device may have been connected in the background before the broker
+        if self.keithley.is_connected():
+            self.keithley_connected()
+
+    # paho 1.x passes (client, userdata, rc), plus properties with MQTT v5
+    def on_disconnect(self, client, userdata, reason_code, properties=None):
+        logger.debug("on_disconnect with reason code %s", reason_code)
+        self._connected = False
         self.disconnected = True, reason_code
+        with self._commands_ready:
+            self._commands_ready.notify()
 
     def on_message(self, client, userdata, message):
         topic = message.topic
 
-        try:
-            payload = json.loads(message.payload.decode())
-        except json.JSONDecodeError as e:
-            logger.debug(f"Error decoding message payload: {e}")
-            payload = {}
+        # reject unknown commands before spending time on their payload
+        handler = self._handlers.get(topic[self._cmd_prefix_len :])
+        if handler is None:
+            logger.warning("Unknown topic %s", topic)
+            return
 
-        logger.debug(f"Received message on topic {topic} with payload {payload}")
-
-        if topic.endswith("/apply_voltage"):
-            self.handle_apply_voltage(payload)
-        elif topic.endswith("/auto_range_source"):
-            self.handle_auto_range_source(payload)
-        elif topic.endswith("/current"):
-            self.handle_current(payload)
-        elif topic.endswith("/current_range"):
-            self.handle_current_range(payload)
-        elif topic.endswith("/disable_source"):
-            self.handle_disable_source(payload)
-        elif topic.endswith("/enable_source"):
-            self.handle_enable_source(payload)
-        elif topic.endswith("/measure_continously"):
-            self.handle_measure_continously(payload)
-        elif topic.endswith("/measure_current"):
-            self.handle_measure_current(payload)
-        elif topic.endswith("/reset"):
-            self.handle_reset(payload)
-        elif topic.endswith("/shutdown"):
-            self.handle_shutdown(payload)
-        elif topic.endswith("/source_enabled"):
-            self.handle_source_enabled(payload)
-        elif topic.endswith("/source_voltage"):
-            self.handle_source_voltage(payload)
-        elif topic.endswith("/source_voltage_range"):
-            self.handle_source_voltage_range(payload)
+        payload_bytes = message.payload
+        if not payload_bytes or payload_bytes == b"{}":
+            # bare triggers like reset or current need no parsing
+            payload = {}
         else:
-            logger.warning(f"Unknown topic {topic}")
+            try:
+                # both parsers take the raw utf-8 bytes, no need to decode first
+                payload = json_loads(payload_bytes)
+            except ValueError as e:
+                logger.debug("Error decoding message payload: %s", e)
+                payload = {}
+
+        logger.debug("Received message on topic %s with payload %s", topic, payload)
+
+        # handled by the main loop, paho's network thread must not wait on the device
+        command = topic[self._cmd_prefix_len :]
+        dropped = None
+        with self._commands_ready:
+            if len(self._commands) >= self._commands_max:
+                dropped = self._commands.popleft()
+            self._commands.append((command, handler, payload))
+            self._commands_ready.notify()
+        if dropped is not None:
+            logger.warning("Command queue full, dropping %s.", dropped[0])
+            self.publish_error(dropped[0], "Command dropped: command queue is full.")
 
     @handle_connection_error
     def handle_apply_voltage(self, payload):
@@ -177,125 +369,107 @@ class Keithley6517BMQTTClient:
         if "value" in payload:
             voltage = payload["value"]
         if voltage == "None" or is_number(voltage):
-            measure_continously_value = self.measure_continously.is_set()
-            self.measure_continously.clear()
-            logger.debug(f"Applying voltage {voltage} to the device")
+            measure_continously = self.measure_continously.is_set()
+            logger.debug("Applying voltage %s to the device", voltage)
             self.keithley.apply_voltage(voltage)
-            self.publish_response("apply_voltage", voltage, payload)
-            (
-                self.measure_continously.set()
-                if measure_continously_value
-                else self.measure_continously.clear()
+            self.publish_response(
+                "apply_voltage", voltage, payload, measure_continously
             )
-            self.publish_measure_continously(payload, self.measure_continously.is_set())
         else:
             self.publish_error("apply_voltage", f"Invalid voltage range: {voltage}")
 
     @handle_connection_error
     def handle_auto_range_source(self, payload):
-        measure_continously_value = self.measure_continously.is_set()
-        self.measure_continously.clear()
-        logger.debug(f"Setting auto_range_source.")
+        measure_continously = self.measure_continously.is_set()
+        logger.debug("Setting auto_range_source.")
         self.keithley.auto_range_source()
         rng = self.keithley.voltage_range
-        self.publish_response("voltage_range", rng, payload)
-        (
-            self.measure_continously.set()
-            if measure_continously_value
-            else self.measure_continously.clear()
-        )
-        self.publish_measure_continously(payload, self.measure_continously.is_set())
+        self.publish_response("voltage_range", rng, payload, measure_continously)
 
     @handle_connection_error
     def handle_current(self, payload):
-        measure_continously_value = self.measure_continously.is_set()
-        self.measure_continously.clear()
+        measure_continously = self.measure_continously.is_set()
         logger.debug("Getting current")
         current = self.keithley.current
-        self.publish_response("current", current, payload)
-        (
-            self.measure_continously.set()
-            if measure_continously_value
-            else self.measure_continously.clear()
-        )
-        self.publish_measure_continously(payload, self.measure_continously.is_set())
+        self.publish_response("current", current, payload, measure_continously)
+
+    @handle_connection_error
+    def handle_current_batch(self, payload):
+        if not isinstance(payload, dict):
+            self.publish_error("current_batch", f"Invalid payload: {payload}")
+            return
+        n = payload.get("n", self.config.get("batch_size", 10))
+        # the whole batch is one worker call, which must finish within the
+        # caller's 10 s wait and holds up every other command meanwhile
+        if (
+            not isinstance(n, int)
+            or isinstance(n, bool)
+            or not 1 <= n <= self._batch_max
+        ):
+            self.publish_error("current_batch", f"Invalid number of samples: {n}")
+            return
+        measure_continously = self.measure_continously.is_set()
+        logger.debug("Getting batch of %s current samples", n)
+        batch = self.keithley.read_current_batch(n)
+        if batch is not None:
+            t0, dt, values = batch
+            batch = {"t0": t0, "dt": dt, "i": values}
+        self.publish_response("current_batch", batch, payload, measure_continously)
 
     @handle_connection_error
     def handle_current_range(self, payload):
-        measure_continously_value = self.measure_continously.is_set()
-        self.measure_continously.clear()
+        measure_continously = self.measure_continously.is_set()
         if "value" in payload:
             current_range = payload["value"]
-            logger.debug(f"Setting current range to {current_range}")
+            logger.debug("Setting current range to %s", current_range)
             self.keithley.current_range = current_range
-        logger.debug("Getting current range")
-        current_range = self.keithley.current_range
-        self.publish_response("current_range", current_range, payload)
-        (
-            self.measure_continously.set()
-            if measure_continously_value
-            else self.measure_continously.clear()
+        if self._verify_writes or "value" not in payload:
+            logger.debug("Getting current range")
+            current_range = self.keithley.current_range
+        self.publish_response(
+            "current_range", current_range, payload, measure_continously
         )
-        self.publish_measure_continously(payload, self.measure_continously.is_set())
 
     @handle_connection_error
     def handle_disable_source(self, payload):
-        measure_continously_value = self.measure_continously.is_set()
-        self.measure_continously.clear()
+        measure_continously = self.measure_continously.is_set()
         logger.debug("Disabling source")
         self.keithley.disable_source()
         enabled = self.keithley.source_enabled
-        self.publish_response("source_enabled", enabled, payload)
-        (
-            self.measure_continously.set()
-            if measure_continously_value
-            else self.measure_continously.clear()
-        )
-        self.publish_measure_continously(payload, self.measure_continously.is_set())
+        self.publish_response("source_enabled", enabled, payload, measure_continously)
 
     @handle_connection_error
     def handle_enable_source(self, payload):
-        measure_continously_value = self.measure_continously.is_set()
-        self.measure_continously.clear()
+        measure_continously = self.measure_continously.is_set()
         logger.debug("Enabling source")
         self.keithley.enable_source()
         enabled = self.keithley.source_enabled
-        self.publish_response("source_enabled", enabled, payload)
-        (
-            self.measure_continously.set()
-            if measure_continously_value
-            else self.measure_continously.clear()
-        )
-        self.publish_measure_continously(payload, self.measure_continously.is_set())
+        self.publish_response("source_enabled", enabled, payload, measure_continously)
 
     @handle_connection_error
     def handle_measure_current(self, payload):
-        measure_continously_value = self.measure_continously.is_set()
-        self.measure_continously.clear()
-        if all_in(["nplc", "current", "auto_range"], payload):
+        measure_continously = self.measure_continously.is_set()
+        if _MEASURE_CURRENT_KEYS.issubset(payload):
             nplc = payload["nplc"]
             current = payload["current"]
             auto_range = payload["auto_range"]
             logger.debug(
-                f"Configures the Keithley 6517B to measure current with nplc={nplc}, current={current}, auto_range={auto_range}"
+                "Configures the Keithley 6517B to measure current with nplc=%s, "
+                "current=%s, auto_range=%s",
+                nplc,
+                current,
+                auto_range,
             )
             self.keithley.measure_current(nplc, current, auto_range)
         rng = self.keithley.current_range
-        self.publish_response("current_range", rng, payload)
-        (
-            self.measure_continously.set()
-            if measure_continously_value
-            else self.measure_continously.clear()
-        )
-        self.publish_measure_continously(payload, self.measure_continously.is_set())
+        self.publish_response("current_range", rng, payload, measure_continously)
 
     @handle_connection_error
     def handle_reset(self, payload):
         self.measure_continously.clear()
         logger.debug("Resetting the device")
         self.keithley.reset()
-        self.publish_response("reset", "done", payload)
-        self.publish_measure_continously(False, payload)
+        self.publish_response("reset", "done", payload, False)
 
     @handle_connection_error
     def handle_shutdown(self, payload):
@@ -303,14 +477,13 @@ class Keithley6517BMQTTClient:
         logger.debug("Shutting down the device")
         self.keithley.shutdown()
         source_enabled = self.keithley.source_enabled
-        self.publish_response("source_enabled", source_enabled, payload)
-        self.publish_measure_continously(False, payload)
+        self.publish_response("source_enabled", source_enabled, payload, False)
 
     @handle_connection_error
     def handle_measure_continously(self, payload):
         if "value" in payload:
             measure_continously = bool(payload["value"])
-            logger.debug(f"Setting measure_continously to {measure_continously}")
+            logger.debug("Setting measure_continously to %s", measure_continously)
             (
                 self.measure_continously.set()
                 if measure_continously
@@ -325,91 +498,83 @@ class Keithley6517BMQTTClient:
 
     @handle_connection_error
     def handle_source_enabled(self, payload):
-        measure_continously_value = self.measure_continously.is_set()
-        self.measure_continously.clear()
+        measure_continously = self.measure_continously.is_set()
         if "value" in payload:
             source_enabled = payload["value"]
-            logger.debug(f"Setting source_enabled to {source_enabled}")
+            logger.debug("Setting source_enabled to %s", source_enabled)
             self.keithley.source_enabled = source_enabled
-        logger.debug("Getting source_enabled")
-        source_enabled = self.keithley.source_enabled
-        self.publish_response("source_enabled", source_enabled, payload)
-        (
-            self.measure_continously.set()
-            if measure_continously_value
-            else self.measure_continously.clear()
+            source_enabled = bool(source_enabled)
+        if self._verify_writes or "value" not in payload:
+            logger.debug("Getting source_enabled")
+            source_enabled = self.keithley.source_enabled
+        self.publish_response(
+            "source_enabled", source_enabled, payload, measure_continously
         )
-        self.publish_measure_continously(payload, self.measure_continously.is_set())
 
     @handle_connection_error
     def handle_source_voltage(self, payload):
-        measure_continously_value = self.measure_continously.is_set()
-        self.measure_continously.clear()
+        measure_continously = self.measure_continously.is_set()
         if "value" in payload:
             voltage = payload["value"]
-            logger.debug(f"Setting source_voltage to {voltage}")
+            logger.debug("Setting source_voltage to %s", voltage)
             self.keithley.source_voltage = voltage
-        logger.debug("Getting source_voltage")
-        voltage = self.keithley.source_voltage
-        self.publish_response("source_voltage", voltage, payload)
-        (
-            self.measure_continously.set()
-            if measure_continously_value
-            else self.measure_continously.clear()
-        )
-        self.publish_measure_continously(payload, self.measure_continously.is_set())
+        if self._verify_writes or "value" not in payload:
+            logger.debug("Getting source_voltage")
+            voltage = self.keithley.source_voltage
+        self.publish_response("source_voltage", voltage, payload, measure_continously)
 
     @handle_connection_error
     def handle_source_voltage_range(self, payload):
-        measure_continously_value = self.measure_continously.is_set()
-        self.measure_continously.clear()
+        measure_continously = self.measure_continously.is_set()
         if "value" in payload:
             source_voltage_range = payload["value"]
-            logger.debug(f"Setting source_voltage_range to {source_voltage_range}")
+            logger.debug("Setting source_voltage_range to %s", source_voltage_range)
             self.keithley.source_voltage_range = source_voltage_range
-        logger.debug("Getting source_voltage_range")
-        source_voltage_range = self.keithley.source_voltage_range
-        self.publish_response("source_voltage_range", source_voltage_range, payload)
-        (
-            self.measure_continously.set()
-            if measure_continously_value
-            else self.measure_continously.clear()
+        if self._verify_writes or "value" not in payload:
+            logger.debug("Getting source_voltage_range")
+            source_voltage_range = self.keithley.source_voltage_range
+        self.publish_response(
+            "source_voltage_range", source_voltage_range, payload, measure_continously
         )
-        self.publish_measure_continously(payload, self.measure_continously.is_set())
 
     def publish_error(self, command, error_message):
-        if self.client is not None and self.client.is_connected():
-            topic = f"{self.topic_base}/error/{self.device_name}/command"
-            payload = json.dumps({"command": command, "error_message": error_message})
-            self.client.publish(topic, payload)
+        if self._connected and self.client is not None:
+            payload = json_dumps({"command": command, "error_message": error_message})
+            self.client.publish(self._error_topic, payload)
 
     def publish_connection_error(self, command, error_message):
-        if self.client is not None and self.client.is_connected():
-            error_payload = json.dumps({"error": error_message, "command": command})
-            self.client.publish(
-                f"{self.topic_base}/error/{self.device_name}/disconnected",
-                json.dumps(error_payload),
-            )
-            logger.debug(f"Publish connection error: {error_message}")
+        if self._connected and self.client is not None:
+            error_payload = json_dumps({"error": error_message, "command": command})
+            self.client.publish(self._disconnected_topic, error_payload)
+            logger.debug("Publish connection error: %s", error_message)
 
-    def publish_response(self, command, value, sender_payload):
-        if self.client is not None and self.client.is_connected():
-            response_payload = json.dumps(
-                {"value": value, "sender_payload": sender_payload}
-            )
-            topic = f"{self.topic_base}/response/{self.device_name}/{command}"
-            self.client.publish(
-                topic,
-                response_payload,
-            )
-            logger.debug(f"Publish topic: {topic}, payload: {response_payload}")
+    def publish_response(
+        self,
+        command,
+        value,
+        sender_payload,
+        measure_continously=None,
+        qos=0,
+        retain=False,
+    ):
+        if self._connected and self.client is not None:
+            response = {"value": value, "sender_payload": sender_payload}
+            if measure_continously is not None:
+                # reported here instead of in a separate measure_continously message
+                response["measure_continously"] = measure_continously
+            response_payload = json_dumps(response)
+            topic = self._response_topics[command]
+            info = self.client.publish(topic, response_payload, qos=qos, retain=retain)
+            logger.debug("Publish topic: %s, payload: %s", topic, response_payload)
+            return info
+        return None
 
     def keithley_connected(self):
-        if self.client is not None and self.client.is_connected():
-            topic = f"{self.topic_base}/connected/{self.device_name}"
+        if self._connected and self.client is not None:
+            topic = self._connected_topic
             payload = "1"
             self.client.publish(topic, payload, retain=True)
-            logger.debug(f"Published keithley connected status to {topic}")
+            logger.debug("Published keithley connected status to %s", topic)
 
             # self.client.publish(
             #     f"{self.topic_base}/response/{self.device_name}/measure_continously",
@@ -444,10 +609,89 @@ class Keithley6517BMQTTClient:
     def stop(self):
         logger.debug("User stop")
         self.user_stop_event.set()
+        with self._commands_ready:
+            self._commands_ready.notify()
         self.measure_continously.clear()
+        self.keithley.stop()
         self.keithley.stop_worker_thread()
 
     def perform_current_measurement(self):
         logger.debug("Time to measure current")
-        if self.client.is_connected() and self.measure_continously.is_set():
-            self.handle_current(payload=json.dumps({"regular": True}))
+        if self._connected and self.measure_continously.is_set():
+            if self.metric_batch_size > 0:
+                self.collect_current_sample()
+            else:
+                self.publish_regular_current()
+        elif self._connected:
+            # continuous mode is off: publish the samples collected before it
+            # was switched off, and the last reading is no longer current
+            if self.keithley.pending_samples:
+                self.publish_samples()
+            if self._current_retained:
+                self.clear_retained_current()
+
+    def publish_regular_current(self):
+        # paho buffers QoS 0 packets without limit while the socket is slow;
+        # skip the tick instead of piling up readings behind an unsent one
+        pending = self._pending_reading
+        if pending is not None and not pending.is_published():
+            logger.debug("Previous current reading not sent yet, skipping")
+            return
+        try:
+            current = self.keithley.current
+        except KeithleyDeviceIOError as e:
+            logger.warning("Error in regular current measurement: %s", e)
+            self.publish_connection_error("current", str(e))
+            if self._current_retained:
+                self.clear_retained_current()
+            return
+        # retained, so late subscribers get the latest reading
+        if type(current) is float and isfinite(current):
+            payload = (
+                _REGULAR_CURRENT_PREFIX
+                + repr(current).encode()
+                + _REGULAR_CURRENT_SUFFIX
+            )
+            info = self.client.publish(
+                self._response_topics["current"], payload, qos=0, retain=True
+            )
+        else:
+            # None, nan or inf: let the JSON encoder decide how to spell them
+            info = self.publish_response(
+                "current", current, _REGULAR_PAYLOAD, True, qos=0, retain=True
+            )
+        self._current_retained = True
+        self._pending_reading = (
+            info if info is not None and info.rc == mqtt.MQTT_ERR_SUCCESS else None
+        )
+
+    def clear_retained_current(self):
+        # an empty retained message deletes the retained reading on the broker
+        self.client.publish(self._response_topics["current"], None, retain=True)
+        self._current_retained = False
+        self._pending_reading = None
+
+    def collect_current_sample(self):
+        try:
+            current = self.keithley.current
+        except KeithleyDeviceIOError as e:
+            logger.warning("Error in collecting current sample: %s", e)
+            self.publish_connection_error("current", str(e))
+        else:
+            # only samples of the continuous measurement go to telemetry, not
+            # one-off current commands
+            if current is not None:
+                self.keithley.record_sample(current)
+        if (
+            self.keithley.pending_samples >= self.metric_batch_size
+            or time() - self.last_flush >= self._flush_interval
+        ):
+            self.publish_samples()
+
+    def publish_samples(self):
+        self.last_flush = time()
+        samples = self.keithley.drain_samples(self.metric_batch_size)
+        if samples and self._connected and self.client is not None:
+            topic = self._telemetry_topic
+            self.client.publish(topic, json_dumps(samples))
+            logger.debug("Published %s samples to %s", len(samples), topic)
@@ -0,0 +1,203 @@
+import time
+import unittest
+from unittest import mock
+
+from keithley6517b_mqtt import keithley6517b_logic
+from keithley6517b_mqtt.keithley6517b_logic import (
+    CommandQueue,
+    Keithley6517BLogic,
+    KeithleyCommandError,
+    KeithleyDeviceIOError,
+    ResultSlot,
+)
+
+
+class FakeAdapter:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeDevice:
+    """Stands in for MyKeithley6517B, counting reads and recording writes."""
+
+    instances = []
+
+    def __init__(self, resource, **kwargs):
+        self.adapter = FakeAdapter()
+        self.reads = 0
+        self.calls = []
+        self._current_range = 2e-3
+        self._source_voltage = 0
+        self._source_enabled = False
+        FakeDevice.instances.append(self)
+
+    @property
+    def current(self):
+        self.reads += 1
+        return 1e-12
+
+    @property
+    def current_nplc(self):
+        return 1.0
+
+    @property
+    def current_range(self):
+        return self._current_range
+
+    @current_range.setter
+    def current_range(self, value):
+        self._current_range = value
+
+    voltage_range = source_voltage_range = current_range
+
+    @property
+    def source_voltage(self):
+        return self._source_voltage
+
+    @source_voltage.setter
+    def source_voltage(self, value):
+        # a str raises TypeError here, as in pymeasure's strict_range validator
+        if not -1000 <= value <= 1000:
+            raise ValueError(f"Value of {value} is not in range [-1000,1000]")
+        self._source_voltage = value
+
+    @property
+    def source_enabled(self):
+        self.reads += 1
+        return self._source_enabled
+
+    def enable_source(self):
+        self.calls.append("enable_source")
+        self._source_enabled = True
+
+    def disable_source(self):
+        self.calls.append("disable_source")
+        self._source_enabled = False
+
+
+CONFIG = {
+    "keithley_visa_resource": "GPIB0::27::INSTR",
+    "keithley_baud_rate": 9600,
+    "keithley_timeout": 100,
+    "cache_ttl_ms": {"source_enabled": 60000},
+}
+
+
+class LogicTestCase(unittest.TestCase):
+    def setUp(self):
+        FakeDevice.instances = []
+        patcher = mock.patch.object(keithley6517b_logic, "MyKeithley6517B", FakeDevice)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.logic = Keithley6517BLogic(dict(CONFIG), on_connected=None)
+        self.addCleanup(self.logic.stop_worker_thread)
+        self.addCleanup(self.logic.stop)
+        deadline = time.monotonic() + 5
+        while not self.logic.is_connected():
+            self.assertLess(time.monotonic(), deadline, "device did not connect")
+            time.sleep(0.01)
+        self.device = FakeDevice.instances[-1]
+
+
+class SourceEnabledSetterTest(LogicTestCase):
+    def test_no_write_when_cached_state_matches(self):
+        self.assertFalse(self.logic.source_enabled)  # cached
+
+        self.logic.source_enabled = False
+
+        self.assertEqual(self.device.calls, [])
+        self.assertIn("source_enabled", self.logic._cache)
+
+    def test_write_and_invalidate_when_state_differs(self):
+        self.assertFalse(self.logic.source_enabled)  # cached
+
+        self.logic.source_enabled = True
+
+        self.assertEqual(self.device.calls, ["enable_source"])
+        self.assertNotIn("source_enabled", self.logic._cache)
+        self.assertTrue(self.logic.source_enabled)
+
+    def test_disable_when_state_differs(self):
+        self.device._source_enabled = True
+
+        self.logic.source_enabled = False
+
+        self.assertEqual(self.device.calls, ["disable_source"])
+
+
+class SetterErrorTest(LogicTestCase):
+    def test_rejected_write_raises(self):
+        with self.assertRaises(KeithleyCommandError):
+            self.logic.source_voltage = "abc"
+
+        self.assertEqual(self.device._source_voltage, 0)
+
+    def test_accepted_write(self):
+        self.logic.source_voltage = 10
+
+        self.assertEqual(self.device._source_voltage, 10)
+
+
+class SharedWorkerTest(LogicTestCase):
+    def test_worker_runs_until_last_instance_stops(self):
+        other = Keithley6517BLogic(dict(CONFIG), on_connected=None)
+        self.addCleanup(other.stop_worker_thread)
+        self.addCleanup(other.stop)
+        worker = Keithley6517BLogic._shared_worker
+
+        other.stop()
+        other.stop_worker_thread()
+        other.stop_worker_thread()  # a second release must not count again
+
+        self.assertTrue(worker.is_alive())
+        self.assertEqual(self.logic.current_nplc, 1.0)
+
+        self.logic.stop()
+        self.logic.stop_worker_thread()
+
+        self.assertFalse(worker.is_alive())
+        self.assertIsNone(Keithley6517BLogic._shared_worker)
+
+
+class ReconnectTest(LogicTestCase):
+    def test_reconnect_closes_previous_session(self):
+        self.logic.try_connect()
+
+        self.assertTrue(self.device.adapter.closed)
+        self.assertIsNot(FakeDevice.instances[-1], self.device)
+        self.assertFalse(FakeDevice.instances[-1].adapter.closed)
+
+
+def noop():
+    pass
+
+
+class CommandQueueTest(unittest.TestCase):
+    def test_overflow_drops_oldest_and_fails_its_caller(self):
+        queue = CommandQueue(maxlen=2)
+        slots = [ResultSlot() for _ in range(3)]
+        for slot in slots:
+            queue.put((noop, None, (), {}, slot))
+
+        self.assertEqual(len(queue), 2)
+        self.assertIsInstance(slots[0].exception, KeithleyDeviceIOError)
+        self.assertTrue(slots[0].event.is_set())
+        self.assertIs(queue.get()[4], slots[1])
+        self.assertIs(queue.get()[4], slots[2])
+
+    def test_stop_sentinel_is_never_dropped(self):
+        queue = CommandQueue(maxlen=1)
+        queue.put(None)
+        slot = ResultSlot()
+        queue.put((noop, None, (), {}, slot))
+
+        self.assertIsNone(queue.get())
+        self.assertIs(queue.get()[4], slot)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+import json
+import os
+import time
+import unittest
+from unittest import mock
+
+from keithley6517b_mqtt import keithley6517b_logic
+from keithley6517b_mqtt.keithley6517b_mqtt_client import Keithley6517BMQTTClient
+
+from .test_keithley6517b_logic import FakeDevice
+
+CONFIG_FILE = os.path.join(os.path.dirname(__file__), os.pardir, "config.yaml")
+
+
+class ClientTestCase(unittest.TestCase):
+    # merged over the settings of config.yaml
+    config_overrides = {}
+
+    def setUp(self):
+        FakeDevice.instances = []
+        patcher = mock.patch.object(keithley6517b_logic, "MyKeithley6517B", FakeDevice)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        load_config = Keithley6517BMQTTClient.load_config
+
+        def load_test_config(client, config_file):
+            return {**load_config(client, config_file), **self.config_overrides}
+
+        patcher = mock.patch.object(
+            Keithley6517BMQTTClient, "load_config", load_test_config
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.client = Keithley6517BMQTTClient(CONFIG_FILE)
+        self.addCleanup(self.client.stop)
+        deadline = time.monotonic() + 5
+        while not self.client.keithley.is_connected():
+            self.assertLess(time.monotonic(), deadline, "device did not connect")
+            time.sleep(0.01)
+        self.client.client = mock.Mock()
+        self.client._connected = True
+        self.publish = self.client.client.publish
+
+
+class SetterResponseTest(ClientTestCase):
+    def test_rejected_write_publishes_error_not_response(self):
+        self.client.handle_source_voltage({"value": "abc"})
+
+        self.assertEqual(self.publish.call_count, 1)
+        topic, payload = self.publish.call_args.args
+        self.assertEqual(topic, self.client._error_topic)
+        self.assertEqual(json.loads(payload)["command"], "source_voltage")
+
+    def test_accepted_write_echoes_value(self):
+        self.client.handle_source_voltage({"value": 10})
+
+        self.assertEqual(self.publish.call_count, 1)
+        topic, payload = self.publish.call_args.args
+        self.assertEqual(topic, self.client._response_topics["source_voltage"])
+        self.assertEqual(json.loads(payload)["value"], 10)
+
+
+class TelemetryFlushTest(ClientTestCase):
+    config_overrides = {"metric_batch_size": 10, "flush_interval": 60}
+
+    def test_samples_are_flushed_once_continuous_mode_is_off(self):
+        for value in (1e-12, 2e-12, 3e-12):
+            self.client.keithley.record_sample(value)
+
+        self.client.perform_current_measurement()
+
+        self.assertEqual(self.client.keithley.pending_samples, 0)
+        topic, payload = self.publish.call_args.args
+        self.assertEqual(topic, self.client._telemetry_topic)
+        self.assertEqual([i for _, i in json.loads(payload)], [1e-12, 2e-12, 3e-12])
+
+
+if __name__ == "__main__":
+    unittest.main()